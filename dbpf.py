@@ -21,10 +21,16 @@ Supports DBPF 1.1 and index versions 7.0, 7.1, 7.2.
 # Copyright (C) 2022-2024 Luke Horwell <code@horwell.me>
 #
 import io
-from typing import Optional
+import mmap
+import os
+import struct
+from typing import BinaryIO, Optional
 
 import qfs
 
+# Packages are written in many small pieces, so buffer them into bigger writes
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 # Known type IDs (represented as ints)
 TYPE_UI_DATA = 0
 TYPE_IMAGE = 2238569388
@@ -36,7 +42,7 @@ class Stream():
     """
     Base class used for other classes to handle file stream operations.
     """
-    def __init__(self, stream: io.BytesIO):
+    def __init__(self, stream: BinaryIO):
         self.stream = stream
 
     def read_at_position(self, start: int, end: int) -> int:
@@ -44,7 +50,6 @@ class Stream():
         From the beginning of the file stream, jump to the specified 'start'
         position, read the bytes until the end position and return an integer.
         """
-        self.stream.seek(0)
         self.stream.seek(start)
         return int.from_bytes(self.stream.read(end - start), "little")
 
@@ -74,15 +79,15 @@ class Header(Stream):
     """
     Describe a header for the DBPF and its index.
     """
-    def __init__(self, stream: io.BytesIO):
+    def __init__(self, stream: BinaryIO):
         super().__init__(stream)
-        self.major_version = self.read_at_position(4, 8)
-        self.minor_version = self.read_at_position(8, 12)
-        self.index_version_major = self.read_at_position(32, 36)
-        self.index_version_minor = self.read_at_position(60, 64)
-        self.index_entry_count = self.read_at_position(36, 40)
-        self.index_start_offset = self.read_at_position(40, 44)
-        self.index_size = self.read_at_position(44, 48)
+
+        # The fields used are within the first 64 bytes (a new package is shorter)
+        self.stream.seek(0)
+        header = self.stream.read(64).ljust(64, b"\0")
+        self.major_version, self.minor_version = struct.unpack_from("<2I", header, 4)
+        self.index_version_major, self.index_entry_count, self.index_start_offset, self.index_size = struct.unpack_from("<4I", header, 32)
+        self.index_version_minor = struct.unpack_from("<I", header, 60)[0]
 
         # For initialising new packages
         if not self.major_version:
@@ -101,11 +106,23 @@ class Header(Stream):
         """Return index version as a decimal number, e.g. 7.1"""
         return float(f"{self.index_version_major}.{self.index_version_minor}")
 
+    @property
+    def has_resource_id(self) -> bool:
+        """Return whether index records include a resource ID (index version 7.2 or later)"""
+        return (self.index_version_major, self.index_version_minor) >= (7, 2)
+
 
 class Entry(object):
     """
     Metadata and data about an individual file in the index
+
+    Files that were compressed in the package are decompressed when their
+    data is first used, so only the files being worked on take up memory.
     """
+    # Packages have thousands of entries, so don't give each one a __dict__
+    __slots__ = ("type_id", "group_id", "instance_id", "resource_id", "file_location", "file_size", "compress",
+                 "_data", "_compressed_data", "_decompressed_size")
+
     def __init__(self):
         self.type_id = 0
         self.group_id = 0
@@ -118,7 +135,38 @@ class Entry(object):
         self.compress = False
 
         # Uncompressed bytes for file content
-        self.data = bytes()
+        self._data: bytes = bytes()
+
+        # Compressed bytes from the package, until they're decompressed
+        self._compressed_data: Optional[bytes] = None
+        self._decompressed_size = 0
+
+    @property
+    def data(self) -> bytes:
+        """
+        Uncompressed bytes for file content.
+        Raises ValueError if the file was compressed and is corrupt.
+        """
+        if self._compressed_data is not None:
+            try:
+                self._data = qfs.decompress(self._compressed_data, self._decompressed_size)
+            except (IndexError, ValueError) as e:
+                raise ValueError(f"Decompression failed. File corrupt: Type ID {self.type_id}, Group ID {self.group_id}, Instance ID {self.instance_id}") from e
+            self._compressed_data = None
+        return self._data
+
+    @data.setter
+    def data(self, value: bytes):
+        self._data = value
+        self._compressed_data = None
+
+    def set_compressed_data(self, compressed_data: bytes, decompressed_size: int):
+        """
+        Set the compressed bytes as read from a package, to be decompressed when the data is first used.
+        """
+        self._data = bytes()
+        self._compressed_data = compressed_data
+        self._decompressed_size = decompressed_size
 
 
 class Index(Stream):
@@ -131,54 +179,52 @@ class Index(Stream):
         self.end = self.start + header.index_size
         self.count = header.index_entry_count
         self.entries: list[Entry] = []
+        self.entries_by_key: dict[tuple[int, int, int, int], Entry] = {} # (type, group, instance, resource ID)
         self.dir = DirectoryFile(stream, header)
 
-        # Load entries from package
-        self.stream.seek(0)
+        # Load entries from package (index version 7.2 adds a resource ID)
+        has_resource_id = header.has_resource_id
+        record = struct.Struct("<6I" if has_resource_id else "<5I")
         self.stream.seek(self.start)
-        for _ in range(0, self.count):
+        # Packages saved by older versions of this program could miss zeros at the end of the file
+        blob = self.stream.read(self.count * record.size).ljust(self.count * record.size, b"\0")
+        for values in record.iter_unpack(blob):
             entry = Entry()
-            entry.type_id = self.read_next_dword()
-            entry.group_id = self.read_next_dword()
-            entry.instance_id = self.read_next_dword()
-            if header.index_version >= 7.2:
-                entry.resource_id = self.read_next_dword()
-            entry.file_location = self.read_next_dword()
-            entry.file_size = self.read_next_dword()
-            self.entries.append(entry)
+            if has_resource_id:
+                entry.type_id, entry.group_id, entry.instance_id, entry.resource_id, entry.file_location, entry.file_size = values
+            else:
+                entry.type_id, entry.group_id, entry.instance_id, entry.file_location, entry.file_size = values
+            self.add_entry(entry)
 
         # Find DIR file in index, indicating some files are compressed
-        self.stream.seek(0)
         for entry in self.entries:
             if entry.type_id == TYPE_DIR:
                 self.dir = DirectoryFile(self.stream, header, entry)
 
-        # If DIR file exists, flag entries that were compressed
-        compressed_index_lookup = {}
-        if self.dir:
-            for dir_entry in self.dir.files:
-                assert isinstance(dir_entry, DirectoryFile.CompressedFile)
-                compressed_index_lookup[(dir_entry.type_id, dir_entry.group_id, dir_entry.instance_id, dir_entry.resource_id)] = dir_entry
-
-            for entry in self.entries:
-                if (entry.type_id, entry.group_id, entry.instance_id, entry.resource_id) in compressed_index_lookup:
-                    entry.compress = True
-
-        # Load files into memory (decompressed)
+        # Load files into memory. Entries in the DIR file are flagged as compressed,
+        # and are decompressed when first used.
+        files_by_key = self.dir.files_by_key
+        seek = self.stream.seek
+        read = self.stream.read
         for entry in self.entries:
-            self.stream.seek(0)
-            self.stream.seek(entry.file_location)
-            raw_data = self.stream.read(entry.file_size)
-
-            if entry.compress:
-                compressed_entry = self.dir.lookup_entry(entry)
-                try:
-                    entry.data = qfs.decompress(bytearray(raw_data), compressed_entry.decompressed_size)
-                except IndexError as e:
-                    raise ValueError(f"Decompression failed. File corrupt: Type ID {entry.type_id}, Group ID {entry.group_id}, Instance ID {entry.instance_id}") from e
+            seek(entry.file_location)
+            raw_data = read(entry.file_size)
+
+            compressed_file = files_by_key.get((entry.type_id, entry.group_id, entry.instance_id, entry.resource_id))
+            if compressed_file is not None:
+                entry.compress = True
+                entry.set_compressed_data(raw_data, compressed_file.decompressed_size)
             else:
                 entry.data = raw_data
 
+    def add_entry(self, entry: Entry):
+        """
+        Add an entry to the index. If there's more than one entry with the same IDs,
+        the first one is returned by lookups.
+        """
+        self.entries.append(entry)
+        self.entries_by_key.setdefault((entry.type_id, entry.group_id, entry.instance_id, entry.resource_id), entry)
+
 
 class DirectoryFile(Stream):
     """
@@ -193,16 +239,20 @@ class DirectoryFile(Stream):
     """
     class CompressedFile(object):
         """Metadata describing a compressed file in the index"""
-        type_id = 0
-        group_id = 0
-        instance_id = 0
-        resource_id = 0 # Index version >= 7.2 only
-        decompressed_size = 0
+        __slots__ = ("type_id", "group_id", "instance_id", "resource_id", "decompressed_size")
+
+        def __init__(self):
+            self.type_id = 0
+            self.group_id = 0
+            self.instance_id = 0
+            self.resource_id = 0 # Index version >= 7.2 only
+            self.decompressed_size = 0
 
-    def __init__(self, stream: io.BytesIO, header: Header, dir_entry: Optional[Entry] = None):
+    def __init__(self, stream: BinaryIO, header: Header, dir_entry: Optional[Entry] = None):
         super().__init__(stream)
         self.header = header
         self.files = []
+        self.files_by_key: dict[tuple[int, int, int, int], DirectoryFile.CompressedFile] = {} # (type, group, instance, resource ID)
         self.group_id = 0
         self.instance_id = 0
         self.resource_id = 0
@@ -212,30 +262,27 @@ class DirectoryFile(Stream):
             self.instance_id = dir_entry.instance_id
             self.resource_id = dir_entry.resource_id
 
-            # Found DIR file, read it
+            # Found DIR file, read it. Each record is 4 or 5 DWORDs (4 bytes each)
+            has_resource_id = self.header.has_resource_id
+            record = struct.Struct("<5I" if has_resource_id else "<4I")
             self.stream.seek(dir_entry.file_location)
-            compressed_count = int(dir_entry.file_size / 16) # (DWORD = 4 bytes) x 4
-            for _ in range(0, compressed_count):
+            compressed_count = dir_entry.file_size // record.size
+            blob = self.stream.read(compressed_count * record.size).ljust(compressed_count * record.size, b"\0")
+            for values in record.iter_unpack(blob):
                 entry = self.CompressedFile()
-                entry.type_id = self.read_next_dword()
-                entry.group_id = self.read_next_dword()
-                entry.instance_id = self.read_next_dword()
-                if self.header.index_version >= 7.2:
-                    entry.resource_id = self.read_next_dword()
-                entry.decompressed_size = self.read_next_dword()
-
+                if has_resource_id:
+                    entry.type_id, entry.group_id, entry.instance_id, entry.resource_id, entry.decompressed_size = values
+                else:
+                    entry.type_id, entry.group_id, entry.instance_id, entry.decompressed_size = values
                 self.files.append(entry)
+                self.files_by_key[(entry.type_id, entry.group_id, entry.instance_id, entry.resource_id)] = entry
 
     def lookup_entry(self, entry: Entry) -> CompressedFile:
         """
         Read the DIR records and return the record for this index entry.
         If not, return an empty record.
         """
-        for compress_entry in self.files:
-            assert isinstance(compress_entry, DirectoryFile.CompressedFile)
-            if entry.type_id == compress_entry.type_id and entry.group_id == compress_entry.group_id and entry.instance_id == compress_entry.instance_id:
-                return compress_entry
-        return self.CompressedFile()
+        return self.files_by_key.get((entry.type_id, entry.group_id, entry.instance_id, entry.resource_id)) or self.CompressedFile()
 
     def add_entry(self, type_id: int, group_id: int, instance_id: int, resource_id: int, decompressed_size: int):
         """
@@ -248,20 +295,21 @@ class DirectoryFile(Stream):
         entry.resource_id = resource_id
         entry.decompressed_size = decompressed_size
         self.files.append(entry)
+        self.files_by_key[(type_id, group_id, instance_id, resource_id)] = entry
 
     def get_bytes(self) -> bytes:
         """
         Return the raw bytes for the DIR file as it is stored in the package.
         """
-        blob = bytearray()
-        for entry in self.files:
-            assert isinstance(entry, DirectoryFile.CompressedFile)
-            blob += entry.type_id.to_bytes(4, "little")
-            blob += entry.group_id.to_bytes(4, "little")
-            blob += entry.instance_id.to_bytes(4, "little")
-            if self.header.index_version >= 7.2:
-                blob += entry.resource_id.to_bytes(4, "little")
-            blob += entry.decompressed_size.to_bytes(4, "little")
+        # Each record is 4 or 5 DWORDs (4 bytes each), the same layout as when reading
+        record = struct.Struct("<5I" if self.header.has_resource_id else "<4I")
+        blob = bytearray(record.size * len(self.files))
+        if self.header.has_resource_id:
+            for position, entry in enumerate(self.files):
+                record.pack_into(blob, position * record.size, entry.type_id, entry.group_id, entry.instance_id, entry.resource_id, entry.decompressed_size)
+        else:
+            for position, entry in enumerate(self.files):
+                record.pack_into(blob, position * record.size, entry.type_id, entry.group_id, entry.instance_id, entry.decompressed_size)
 
         return blob
 
@@ -275,18 +323,49 @@ class DBPF(Stream):
     https://www.wiki.sc4devotion.com/index.php?title=DBPF
     https://www.wiki.sc4devotion.com/images/e/e8/DBPF_File_Format_v1.1.png
     """
-    def __init__(self, path: str = ""):
+    def __init__(self, path: str|BinaryIO = ""):
         """
         Read an existing DBPF package, or leave blank to create a new one.
+
+        The package can be a path, or a file already opened in binary mode
+        (or a memory-mapped file). Files are read directly without copying
+        them into memory first. An open file should stay open until the package
+        has been read.
         """
         super().__init__(io.BytesIO(bytearray(32)))
-        if path:
+        if isinstance(path, str) and path:
             with open(path, "rb") as f:
-                self.stream = io.BytesIO(f.read())
-
+                if os.fstat(f.fileno()).st_size == 0:
+                    # Empty files can't be mapped, and are read as an empty package
+                    self._read(io.BytesIO())
+                else:
+                    # Map the file into memory so it's read straight from the OS cache.
+                    # Entries keep copies of their own data, so it's closed once read.
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        self._read(mapped) # type: ignore
+                    self._detach_stream()
+        elif path:
+            self._read(path)
+        else:
+            self._read(self.stream)
+
+    def _read(self, stream: BinaryIO):
+        """
+        Read the header and index from the package's file stream.
+        """
+        self.stream = stream
         self.header = Header(self.stream)
         self.index = Index(self.stream, self.header)
 
+    def _detach_stream(self):
+        """
+        Replace the stream once the package has been read from a file that's now closed,
+        so the package can still be pickled and Stream methods don't fail.
+        """
+        self.stream = io.BytesIO()
+        for obj in (self.header, self.index, self.index.dir):
+            obj.stream = self.stream
+
     def _compress_data(self, data: bytes, _count: int, _total_entries: int) -> bytes:
         """
         Compress file data using QFS compression when saving the package.
@@ -301,7 +380,7 @@ class DBPF(Stream):
         decompressed_size = len(data)
 
         try:
-            output = qfs.compress(bytearray(data))
+            output = qfs.compress(data)
         except IndexError:
             return bytes()
 
@@ -313,10 +392,10 @@ class DBPF(Stream):
         # (For example, certain bitmaps might compress, but fail to decompress)
         self.cb_save_progress_updated("Verifying", _count, _total_entries)
         try:
-            expected_data = qfs.decompress(bytearray(output), decompressed_size)
+            expected_data = qfs.decompress(output, decompressed_size)
             if expected_data != data:
                 return bytes()
-        except IndexError:
+        except (IndexError, ValueError):
             return bytes()
 
         return output
@@ -345,10 +424,10 @@ class DBPF(Stream):
         """
         Return a single entry from the index.
         """
-        for entry in self.index.entries:
-            if entry.type_id == type_id and entry.group_id == group_id and entry.instance_id == instance_id and entry.resource_id == resource_id:
-                return entry
-        raise ValueError(f"Entry not found: Type ID {type_id}, Group ID {group_id}, Instance ID {instance_id}, Resource ID {resource_id}")
+        try:
+            return self.index.entries_by_key[(type_id, group_id, instance_id, resource_id)]
+        except KeyError as e:
+            raise ValueError(f"Entry not found: Type ID {type_id}, Group ID {group_id}, Instance ID {instance_id}, Resource ID {resource_id}") from e
 
     def add_entry(self, type_id: int, group_id: int, instance_id: int, resource_id: int, data: bytes, compress=False) -> Entry:
         """
@@ -361,7 +440,7 @@ class DBPF(Stream):
         entry.resource_id = resource_id
         entry.data = data
         entry.compress = compress
-        self.index.entries.append(entry)
+        self.index.add_entry(entry)
         return entry
 
     def add_entry_from_file(self, type_id: int, group_id: int, instance_id: int, resource_id: int, path: str, compress=False) -> Entry:
@@ -382,32 +461,29 @@ class DBPF(Stream):
         - Generate the DIR record for compressed files.
         - Compress entries marked as "compress".
         """
-        def _write_int_at_pos(position: int, integer: int):
-            f.seek(position)
-            f.write(integer.to_bytes(integer.bit_length(), "little"))
-
-        def _write_int_next_4_bytes(integer):
-            f.tell()
-            end = f.tell() + 4
-            f.write(integer.to_bytes(integer.bit_length(), "little"))
-            f.seek(end)
-
         # Check the file is writable, and create if doesn't exist
         try:
-            open(path, "wb").close()
+            f = open(path, "wb", buffering=WRITE_BUFFER_SIZE) # pylint: disable=consider-using-with
         except PermissionError as e:
             raise PermissionError("Permission denied. Check the permissions and try again.") from e
 
+        with f:
+            self._write_package(f)
+
+    def _write_package(self, f: BinaryIO):
+        """
+        Write the package to a file opened by save_package().
+        The header is written last, once the index location is known.
+        """
         # Allocate bytes for header
-        f = open(path, "wb")
         f.write(bytes(96))
 
         # Prepare a fresh DIR index, if there's any compressed files.
         needs_dir_record = False
         self.index.dir.files = []
+        self.index.dir.files_by_key = {}
 
         # Write file data after the header
-        f.seek(96)
         entries = self.get_entries()
         total_entries = len(entries)
 
@@ -448,47 +524,36 @@ class DBPF(Stream):
             f.write(self.index.dir.get_bytes())
             entry.file_size = f.tell() - entry.file_location
 
-            self.index.entries.append(entry)
+            self.index.add_entry(entry)
 
         # Write index after the file data
         self.cb_save_progress_updated("Saving", 9999, 10000)
         self.header.index_start_offset = f.tell()
         self.header.index_entry_count = len(self.index.entries)
 
-        for entry in self.index.entries:
-            _write_int_next_4_bytes(entry.type_id)
-            _write_int_next_4_bytes(entry.group_id)
-            _write_int_next_4_bytes(entry.instance_id)
-            if self.header.index_version >= 7.2:
-                _write_int_next_4_bytes(entry.resource_id)
-            _write_int_next_4_bytes(entry.file_location)
-            _write_int_next_4_bytes(entry.file_size)
-
-        self.header.index_size = f.tell() - self.header.index_start_offset
-
-        # Write header: DBPF
-        f.seek(0)
-        f.write(b'\x44\x42\x50\x46')
-
-        # Write header: Major version
-        _write_int_at_pos(4, self.header.major_version)
-
-        # Write header: Minor version
-        _write_int_at_pos(8, self.header.minor_version)
-
-        # Write header: Index version major
-        _write_int_at_pos(32, self.header.index_version_major)
+        # Each index record is 5 or 6 DWORDs (4 bytes each)
+        has_resource_id = self.header.has_resource_id
+        record = struct.Struct("<6I" if has_resource_id else "<5I")
+        index = bytearray(record.size * self.header.index_entry_count)
+        for position, entry in enumerate(self.index.entries):
+            if has_resource_id:
+                record.pack_into(index, position * record.size, entry.type_id, entry.group_id, entry.instance_id, entry.resource_id, entry.file_location, entry.file_size)
+            else:
+                record.pack_into(index, position * record.size, entry.type_id, entry.group_id, entry.instance_id, entry.file_location, entry.file_size)
+        f.write(index)
 
-        # Write header: Index entry count
-        _write_int_at_pos(36, self.header.index_entry_count)
+        self.header.index_size = len(index)
 
-        # Write header: Index start offset
-        _write_int_at_pos(40, self.header.index_start_offset)
+        # Write header: DBPF, major and minor version
+        header = bytearray(96)
+        header[0:4] = b"DBPF"
+        struct.pack_into("<2I", header, 4, self.header.major_version, self.header.minor_version)
 
-        # Write header: Index entry size
-        _write_int_at_pos(44, self.header.index_size)
+        # Write header: Index version major, entry count, start offset and size
+        struct.pack_into("<4I", header, 32, self.header.index_version_major, self.header.index_entry_count, self.header.index_start_offset, self.header.index_size)
 
         # Write header: Index version minor
-        _write_int_at_pos(60, self.header.index_version_minor)
+        struct.pack_into("<I", header, 60, self.header.index_version_minor)
 
-        f.close()
+        f.seek(0)
+        f.write(header)
@@ -17,11 +17,16 @@ Describes a game file and whether it is currently patched.
 #
 # Copyright (C) 2023-2024 Luke Horwell <code@horwell.me>
 #
+import functools
 import os
 import shutil
+from typing import Dict, Optional, Tuple
 
 FILE_PATCH_VERSION: float = 0.0 # Set by main program
 
+# Patch versions read from metadata files (path -> (mtime, size, version))
+_meta_cache: Dict[str, Tuple[int, int, Optional[float]]] = {}
+
 
 class GameFile():
     """
@@ -57,14 +62,7 @@ class GameFile():
         Identify the game name by going up a directory until we find "filelist.txt",
         the root of the game installation, and take the name from this directory.
         """
-        path = os.path.realpath(file_path)
-        root_count = len(path.split(os.sep))
-        while root_count > 2:
-            if os.path.exists(os.path.join(path, "filelist.txt")):
-                return path.split(os.sep)[-1]
-            path = os.path.realpath(os.path.join(path, ".."))
-            root_count = len(path.split(os.sep))
-        return file_path
+        return _find_game_name(file_path)
 
     def read_meta_file(self):
         """
@@ -76,19 +74,32 @@ class GameFile():
         1-3     Message for user
         4       Patcher version used (float, e.g. 1.2 ≈ major.minor)
         """
-        if os.path.exists(self.meta_path):
-            self.patched = True
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return
+
+        # Only read the file again if it changed since last time
+        cached = _meta_cache.get(self.meta_path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            version = cached[2]
+        else:
+            version = None
             with open(self.meta_path, "r", encoding="utf-8") as f:
                 try:
                     # Messages for user (ignored)
                     for _ in range(4):
                         f.readline()
 
-                    self.patched_version = float(f.readline().strip())
-                    self.patch_outdated = self.patched_version < FILE_PATCH_VERSION
+                    version = float(f.readline().strip())
                 except ValueError:
                     print("Malformed metadata file:", self.meta_path)
-                    self.patched = False
+            _meta_cache[self.meta_path] = (stat.st_mtime_ns, stat.st_size, version)
+
+        if version is not None:
+            self.patched = True
+            self.patched_version = version
+            self.patch_outdated = self.patched_version < FILE_PATCH_VERSION
 
     def write_meta_file(self):
         """
@@ -97,6 +108,7 @@ class GameFile():
         if not self.patched or not self.backed_up:
             raise RuntimeError("Not patched or backup file missing!")
 
+        _meta_cache.pop(self.meta_path, None)
         with open(self.meta_path, "w", encoding="utf-8") as f:
             f.write("# This file was patched by lah7/sims2-4k-ui-patch.\n")
             f.write("# It is recommended to keep this file (and the .bak) so you can update the patches or revert without reinstalling the game.\n")
@@ -104,6 +116,15 @@ class GameFile():
             f.write("\n")
             f.write(f"{FILE_PATCH_VERSION}\n")
 
+    def delete_meta_file(self):
+        """
+        Delete the file describing the patch, such as before the game file is re-patched.
+        """
+        _meta_cache.pop(self.meta_path, None)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        self.patched = False
+
     def backup(self):
         """
         Create a backup of the original game file.
@@ -120,6 +141,23 @@ class GameFile():
         if os.path.exists(self.backup_path):
             os.remove(self.file_path)
             shutil.move(self.backup_path, self.file_path)
+            _meta_cache.pop(self.meta_path, None)
             if os.path.exists(self.meta_path):
                 os.remove(self.meta_path)
             self.backed_up = False
+
+
+@functools.cache
+def _find_game_name(file_path: str) -> str:
+    """
+    Return the name of the game's installation folder containing this file.
+    This doesn't change while the program is running, so it's only looked up once per path.
+    """
+    path = os.path.realpath(file_path)
+    root_count = len(path.split(os.sep))
+    while root_count > 2:
+        if os.path.exists(os.path.join(path, "filelist.txt")):
+            return path.split(os.sep)[-1]
+        path = os.path.realpath(os.path.join(path, ".."))
+        root_count = len(path.split(os.sep))
+    return file_path
@@ -22,12 +22,18 @@ interface by doubling the density of graphics and fonts and adjusting UI geometr
 #
 # Copyright (C) 2022-2024 Luke Horwell <code@horwell.me>
 #
+import functools
 import io
-from typing import Callable
+import multiprocessing.queues
+import queue
+import threading
+import time
+from typing import Callable, Optional
 
 from PIL import Image
 
 import dbpf
+import gamefile
 from gamefile import GameFile
 
 # Density to multiply the UI dialog geometry and graphics
@@ -39,6 +45,13 @@ COMPRESS_PACKAGE: bool = False
 # Image upscaling filter
 UPSCALE_FILTER: Image.Resampling = Image.Resampling.NEAREST # NEAREST, BOX, BILINEAR, HAMMING, BICUBIC, LANCZOS
 
+# Set by init_worker() to stop patching early in worker processes
+_abort_event: Optional[threading.Event] = None # pylint: disable=invalid-name
+
+# Set by init_worker() to send progress from worker processes to the main program
+_progress_queue: Optional[multiprocessing.queues.Queue] = None # pylint: disable=invalid-name
+_progress_last_sent = (0.0, "", 0) # Time, file path and total
+
 # Image file types
 IMAGE_FORMAT_BMP = "BMP"
 IMAGE_FORMAT_JPG = "JPEG"
@@ -139,24 +152,57 @@ def _upscale_uiscript(entry: dbpf.Entry):
     return data.encode("utf-8")
 
 
-def upscale_package_contents(file: GameFile, package: dbpf.DBPF, ui_update_progress: Callable):
+def init_worker(multiplier: int, upscale_filter: Image.Resampling, compress: bool = False, patch_version: Optional[float] = None,
+                abort: Optional[threading.Event] = None, progress: Optional[multiprocessing.queues.Queue] = None):
+    """
+    Initialise a worker process used by patch_game_file().
+    Settings changed by the main program are not inherited when the process
+    is spawned (Windows), so they are passed again here.
+
+    The abort event must be a multiprocessing.Event to be seen by the worker.
+    When a progress queue is given, patch_game_file() puts (path, text, value, total)
+    tuples on it, where path is the game file being patched and total is None unless it changed.
+    """
+    global UI_MULTIPLIER, UPSCALE_FILTER, COMPRESS_PACKAGE, _abort_event, _progress_queue # pylint: disable=global-statement
+    UI_MULTIPLIER = multiplier
+    UPSCALE_FILTER = upscale_filter
+    COMPRESS_PACKAGE = compress
+    _abort_event = abort
+    _progress_queue = progress
+    if patch_version is not None:
+        gamefile.FILE_PATCH_VERSION = patch_version
+
+
+def upscale_package_contents(file: GameFile, package: dbpf.DBPF, ui_update_progress: Callable, abort: Optional[threading.Event] = None):
     """
     Processes a DBPF package and upscales the user interface resources.
+
+    If the abort event is set, processing stops before the next entry
+    and the game file is left untouched.
+
+    To reduce memory usage, the data for UI scripts and images in the original
+    package is released once upscaled, so the package shouldn't be reused.
     """
     new_package = dbpf.DBPF()
     entries = package.get_entries()
     completed = 0
     total = len(entries)
+
     for entry in entries:
+        if abort and abort.is_set():
+            return
+
         ui_update_progress(f"{completed}/{total}: {file.relative_path}", completed)
 
         if entry.type_id == dbpf.TYPE_UI_DATA:
             data = _upscale_uiscript(entry)
             new_package.add_entry(entry.type_id, entry.group_id, entry.instance_id, entry.resource_id, data, entry.compress and COMPRESS_PACKAGE)
+            entry.data = bytes()
 
         elif entry.type_id == dbpf.TYPE_IMAGE:
             data = _upscale_graphic(entry)
             new_package.add_entry(entry.type_id, entry.group_id, entry.instance_id, entry.resource_id, data, entry.compress and COMPRESS_PACKAGE)
+            entry.data = bytes()
 
         elif entry.type_id == dbpf.TYPE_ACCEL_DEF:
             # No modifications necessary
@@ -182,6 +228,58 @@ def upscale_package_contents(file: GameFile, package: dbpf.DBPF, ui_update_progr
     file.write_meta_file()
 
 
+def _send_progress(file: GameFile, text: str, value: int|float, total: Optional[int] = None):
+    """
+    Send progress for a game file to the main program, if init_worker() was given a queue.
+    Updates are limited to 10 per second, unless there's a new file or total.
+    """
+    global _progress_last_sent # pylint: disable=global-statement
+    if _progress_queue:
+        now = time.monotonic()
+        last_time, last_path, last_total = _progress_last_sent
+        if file.file_path == last_path and total in (None, last_total) and now - last_time < 0.1:
+            return
+        _progress_last_sent = (now, file.file_path, total or last_total)
+        try:
+            _progress_queue.put_nowait((file.file_path, text, value, total))
+        except queue.Full:
+            pass
+
+
+def patch_game_file(file: GameFile, ui_update_progress: Optional[Callable] = None):
+    """
+    Back up and patch a single game file. If the file was previously patched,
+    its backup (the original file) is patched instead.
+
+    Files are independent of each other, so this can run in a worker process
+    initialised with init_worker(). Unless a callback is given, progress is
+    sent to the main program.
+    """
+    if _abort_event and _abort_event.is_set():
+        return
+
+    if ui_update_progress is None:
+        ui_update_progress = functools.partial(_send_progress, file)
+
+    if file.backed_up:
+        # Always assume the original file is stored as the backup.
+        # Patches read from the backup and overwrite the game file, so it
+        # doesn't need restoring first. Until then, it's no longer patched.
+        file.delete_meta_file()
+    else:
+        # Always create a copy of the original before processing
+        file.backup()
+
+    if file.name == "FontStyle.ini":
+        upscale_fontstyle_ini(file)
+
+    elif file.name in ["ui.package", "CaSIEUI.data"]:
+        package = dbpf.DBPF(file.backup_path)
+        total = len(package.get_entries())
+        ui_update_progress(f"0/{total}: {file.relative_path}", 0, total)
+        upscale_package_contents(file, package, ui_update_progress, abort=_abort_event)
+
+
 def upscale_fontstyle_ini(file: GameFile, write_meta_file=True):
     """
     Parses FontStyle.ini (from the Fonts folder) and writes a new one with
@@ -21,9 +21,11 @@ MAX_COPY_COUNT = 0x404
 QFS_MAXITER = 20
 
 
-def _copy_array(src: bytearray, src_pos: int, dest: bytearray, dest_pos: int, length: int) -> bytearray:
-    for i in range(length):
-        dest[dest_pos + i] = src[src_pos + i]
+def _copy_array(src: bytes|bytearray, src_pos: int, dest: bytearray, dest_pos: int, length: int) -> bytearray:
+    chunk = src[src_pos:src_pos + length]
+    if len(chunk) < length or dest_pos + length > len(dest):
+        raise IndexError("bytearray index out of range")
+    dest[dest_pos:dest_pos + length] = chunk
     return dest
 
 
@@ -32,77 +34,75 @@ def _offset_copy(array: bytearray, offset: int, dest_pos: int, length: int) -> b
     if len(array) < dest_pos + length:
         raise ValueError("Error: array too small")
 
-    for i in range(length):
-        array[dest_pos + i] = array[src_pos + i]
+    if src_pos < 0:
+        # Corrupt data: copy byte by byte to behave as before
+        for i in range(length):
+            array[dest_pos + i] = array[src_pos + i]
+    elif offset >= length:
+        array[dest_pos:dest_pos + length] = array[src_pos:src_pos + length]
+    else:
+        # The source overlaps what's being written, which repeats the last "offset" bytes
+        pattern = array[src_pos:dest_pos]
+        array[dest_pos:dest_pos + length] = (pattern * (length // offset + 1))[:length]
     return array
 
 
-def decompress(compressed_data: bytearray, decompressed_size: int) -> bytes:
+def decompress(compressed_data: bytes|bytearray, decompressed_size: int) -> bytes:
     """
     Return decompressed data as bytes.
     """
     decompressed_data = bytearray(decompressed_size)
+    compressed_size = len(compressed_data)
     dest_pos = 0
     pos = 9 # skip header
     control1 = 0
 
-    while control1 < 0xFC and pos < len(compressed_data):
+    while control1 < 0xFC and pos < compressed_size:
         control1 = compressed_data[pos]
         pos += 1
-        if control1 >= 0 and control1 <= 127:
+        if control1 <= 127:
             control2 = compressed_data[pos]
             pos += 1
             num_plain_text = control1 & 0x03
-            decompressed_data = _copy_array(compressed_data, pos, decompressed_data, dest_pos, num_plain_text)
-            dest_pos += num_plain_text
-            pos += num_plain_text
             offset = ((control1 & 0x60) << 3) + (control2) + 1
             num_to_copy_from_offset = ((control1 & 0x1C) >> 2) + 3
-            decompressed_data = _offset_copy(decompressed_data, offset, dest_pos, num_to_copy_from_offset)
-            dest_pos += num_to_copy_from_offset
-        elif control1 >= 128 and control1 <= 191:
+        elif control1 <= 191:
             control2 = compressed_data[pos]
-            pos += 1
-            control3 = compressed_data[pos]
-            pos += 1
+            control3 = compressed_data[pos + 1]
+            pos += 2
             num_plain_text = (control2 >> 6) & 0x03
-            decompressed_data = _copy_array(compressed_data, pos, decompressed_data, dest_pos, num_plain_text)
-            dest_pos += num_plain_text
-            pos += num_plain_text
             offset = ((control2 & 0x3F) << 8) + (control3) + 1
             num_to_copy_from_offset = (control1 & 0x3F) + 4
-            decompressed_data = _offset_copy(decompressed_data, offset, dest_pos, num_to_copy_from_offset)
-            dest_pos += num_to_copy_from_offset
-        elif control1 >= 192 and control1 <= 223:
+        elif control1 <= 223:
             num_plain_text = control1 & 0x03
             control2 = compressed_data[pos]
-            pos += 1
-            control3 = compressed_data[pos]
-            pos += 1
-            control4 = compressed_data[pos]
-            pos += 1
-            decompressed_data = _copy_array(compressed_data, pos, decompressed_data, dest_pos, num_plain_text)
-            dest_pos += num_plain_text
-            pos += num_plain_text
+            control3 = compressed_data[pos + 1]
+            control4 = compressed_data[pos + 2]
+            pos += 3
             offset = ((control1 & 0x10) << 12) + (control2 << 8) + (control3) + 1
             num_to_copy_from_offset = ((control1 & 0x0C) << 6) + (control4) + 5
-            decompressed_data = _offset_copy(decompressed_data, offset, dest_pos, num_to_copy_from_offset)
-            dest_pos += num_to_copy_from_offset
-        elif control1 >= 224 and control1 <= 251:
+        elif control1 <= 251:
             num_plain_text = ((control1 & 0x1F) << 2) + 4
-            decompressed_data = _copy_array(compressed_data, pos, decompressed_data, dest_pos, num_plain_text)
-            dest_pos += num_plain_text
-            pos += num_plain_text
+            offset = 0
+            num_to_copy_from_offset = 0
         else:
             num_plain_text = control1 & 0x03
-            decompressed_data = _copy_array(compressed_data, pos, decompressed_data, dest_pos, num_plain_text)
+            offset = 0
+            num_to_copy_from_offset = 0
+
+        if num_plain_text:
+            _copy_array(compressed_data, pos, decompressed_data, dest_pos, num_plain_text)
             dest_pos += num_plain_text
             pos += num_plain_text
 
+        if num_to_copy_from_offset:
+            _offset_copy(decompressed_data, offset, dest_pos, num_to_copy_from_offset)
+            dest_pos += num_to_copy_from_offset
+
     return decompressed_data
 
 
-def compress(data: bytearray) -> bytes:
+def compress(data: bytes|bytearray) -> bytes:
     """
     Compresses data using the QFS algorithm and returns the data for
     inclusion in the DBPF package.
@@ -110,8 +110,11 @@ def compress(data: bytearray) -> bytes:
     Make sure to add an entry in the DIR file, and check if the
     data lengths are correct (in event there was nothing to compress)
     """
-    # Contains the latest offset for a combination of two characters
-    cmpmap2 = {}
+    # Contains the offsets for each combination of three bytes.
+    # Slices of bytes are used as keys, which is quicker than combining the bytes into an int.
+    cmpmap2: dict[bytes, list] = {}
+    source = bytes(data)
+    size = len(source)
 
     # Contains the compressed data (maximal size = uncompressedSize+MAX_COPY_COUNT)
     output = bytearray(len(data) + MAX_COPY_COUNT)
@@ -125,20 +128,19 @@ def compress(data: bytearray) -> bytes:
     end = False
 
     # Begin main compression loop
-    while index < len(data) - 3:
+    while index < size - 3:
         # Get all compression candidates
         # (list of offsets for all occurrences of the current 3 bytes)
         while True:
             index += 1
-            if index >= len(data) - 2:
+            if index >= size - 2:
                 end = True
                 break
 
-            map_index: int = (data[index] & 0xFF) | ((data[index + 1] & 0xFF) << 8) | ((data[index + 2] & 0xFF) << 16)
-
-            index_list: list = cmpmap2.get(map_index) or []
-            if not index_list:
-                cmpmap2[map_index] = index_list
+            map_index = source[index:index + 3]
+            index_list = cmpmap2.get(map_index) # type: ignore
+            if index_list is None:
+                index_list = cmpmap2[map_index] = []
             index_list.append(index)
             if index >= last_read_index:
                 break
@@ -147,24 +149,25 @@ def compress(data: bytearray) -> bytes:
 
         # Find the longest repeating byte sequence in the index list (for offset copy)
         offset_copy_count = 0
-        loop_index = 1
-        while loop_index < len(index_list) and loop_index < QFS_MAXITER:
-            found_index = index_list[len(index_list) - 1 - loop_index]
-            if index - found_index >= MAX_OFFSET:
+        copy_limit = min(size - index, MAX_COPY_COUNT)
+        for found_index in index_list[-2:-QFS_MAXITER - 1:-1]:
+            if index - found_index >= MAX_OFFSET or offset_copy_count >= copy_limit:
                 break
-            loop_index += 1
+
+            # Only a match that continues past the longest so far can replace it
+            if source[index + offset_copy_count] != source[found_index + offset_copy_count]:
+                continue
+
             copy_count = 3
-            while (len(data) > index + copy_count
-                    and data[index + copy_count] == data[found_index + copy_count]
-                    and copy_count < MAX_COPY_COUNT):
+            while copy_count < copy_limit and source[index + copy_count] == source[found_index + copy_count]:
                 copy_count += 1
             if copy_count > offset_copy_count:
                 offset_copy_count = copy_count
                 copy_offset = index - found_index
 
         # Check if this can be compressed
-        if offset_copy_count > len(data) - index:
-            offset_copy_count = index - len(data)
+        if offset_copy_count > size - index:
+            offset_copy_count = index - size
         if offset_copy_count <= 2:
             offset_copy_count = 0
         elif (offset_copy_count == 3) and (copy_offset > 0x400): # 1024
@@ -183,7 +186,7 @@ def compress(data: bytearray) -> bytes:
                 write_index += 1
 
                 copy_count = 4 * copy_count + 4
-                output = _copy_array(data, last_read_index, output, write_index, copy_count)
+                output = _copy_array(source, last_read_index, output, write_index, copy_count)
                 last_read_index += copy_count
                 write_index += copy_count
 
@@ -213,13 +216,13 @@ def compress(data: bytearray) -> bytes:
                 write_index += 1
 
             # Do the offset copy
-            output = _copy_array(data, last_read_index, output, write_index, copy_count)
+            output = _copy_array(source, last_read_index, output, write_index, copy_count)
             write_index += copy_count
             last_read_index += copy_count
             last_read_index += offset_copy_count
 
     # Add the end record
-    index = len(data)
+    index = size
     while index - last_read_index >= 4:
         copy_count = int((index - last_read_index) // 4 - 1)
         if copy_count > 0x1B:
@@ -228,14 +231,14 @@ def compress(data: bytearray) -> bytes:
         write_index += 1
         copy_count = 4 * copy_count + 4
 
-        output = _copy_array(data, last_read_index, output, write_index, copy_count)
+        output = _copy_array(source, last_read_index, output, write_index, copy_count)
         last_read_index += copy_count
         write_index += copy_count
 
     copy_count = index - last_read_index
     output[write_index] = 0xFC + copy_count
     write_index += 1
-    output = _copy_array(data, last_read_index, output, write_index, copy_count)
+    output = _copy_array(source, last_read_index, output, write_index, copy_count)
     write_index += copy_count
     last_read_index += copy_count
 
@@ -24,21 +24,28 @@ See patches.py for actual patching code.
 #
 # Copyright (C) 2023-2024 Luke Horwell <code@horwell.me>
 #
+import functools
 import glob
+import json
+import multiprocessing
 import os
+import queue
 import sys
+import threading
+import time
 import tkinter as tk
 import webbrowser
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
 from tkinter import filedialog, messagebox, ttk
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 
-import requests
-
-import dbpf
 import gamefile
-import patches
 from gamefile import GameFile
 
+# PIL, urllib and the package modules are imported when first needed,
+# so the window can be shown sooner.
+
 MAJOR = 0 # For new patches
 MINOR = 1 # For fixed patches
 PATCH = 0 # For trivial or UI fixes
@@ -55,6 +62,87 @@ DEFAULT_PATHS = [
 ]
 
 PROJECT_URL = "https://github.com/lah7/sims2-4k-ui-patch"
+VERSION_URL = "https://raw.githubusercontent.com/lah7/sims2-4k-ui-patch/master/version.txt"
+
+# Remember the latest version to avoid checking online on every launch
+if os.name == "nt":
+    CACHE_DIR = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "sims2-4k-ui-patch")
+else:
+    CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "sims2-4k-ui-patch")
+VERSION_CACHE_PATH = os.path.join(CACHE_DIR, "version_cache.json")
+VERSION_CACHE_SECONDS = 24 * 60 * 60
+
+PATCHABLE_FILES = ["ui.package", "FontStyle.ini", "CaSIEUI.data"]
+
+# Folders under TSData that never contain patchable files, so aren't searched
+SKIPPED_DIRS = ["Sound", "Movies"]
+
+# Each worker process holds a whole package in memory, so don't start too many
+MAX_WORKERS = 16
+
+# On Linux, worker processes are forked from a server process that has already imported the
+# patching code. This program is multi-threaded, so it isn't safe to fork the program itself.
+# Windows can only spawn, and forking on macOS is unsafe with its system frameworks.
+MP_CONTEXT = multiprocessing.get_context("forkserver" if sys.platform == "linux" else "spawn")
+if sys.platform == "linux":
+    MP_CONTEXT.set_forkserver_preload(["patches", "dbpf"])
+
+# Resources bundled with the application. When ran outside of PyInstaller, use the current directory
+RESOURCE_DIR = getattr(sys, "_MEIPASS", os.path.abspath("."))
+
+
+def get_resource(relative_path: str) -> str:
+    """Get the path to a resource bundled with the application"""
+    return os.path.join(RESOURCE_DIR, relative_path)
+
+
+@functools.cache
+def find_default_games_dir() -> str:
+    """
+    Return the first EA Games folder that exists from the default paths, or an empty string.
+    The result is remembered for the rest of the session.
+    """
+    for path in DEFAULT_PATHS:
+        if os.path.exists(path):
+            return path
+    return ""
+
+
+def get_cpu_count() -> int:
+    """
+    Return the number of CPUs this program is allowed to use.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def read_version_cache(max_age: Optional[float] = VERSION_CACHE_SECONDS) -> str:
+    """
+    Return the latest version found by a recent update check,
+    or an empty string if it's time to check again.
+    When max_age is None, return the last result regardless of its age.
+    """
+    try:
+        with open(VERSION_CACHE_PATH, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if max_age is None or time.time() - cache["checked"] < max_age:
+            return str(cache["version"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return ""
+
+
+def write_version_cache(latest_version: str):
+    """Remember the latest version and when it was checked"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Replace the file in one step, so a partly written file is never read
+        with open(VERSION_CACHE_PATH + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"checked": time.time(), "version": latest_version}, f)
+        os.replace(VERSION_CACHE_PATH + ".tmp", VERSION_CACHE_PATH)
+    except OSError:
+        pass
 
 
 class PatcherApplication(tk.Tk):
@@ -78,12 +166,6 @@ class PatcherApplication(tk.Tk):
         banner_bg = "#394072"
         self.banner.configure(background=banner_bg)
 
-        def get_resource(relative_path):
-            """Get a resource bundled with the application. When ran outside of PyInstaller, use the current directory"""
-            if hasattr(sys, "_MEIPASS"):
-                return os.path.join(sys._MEIPASS, relative_path) # type: ignore # pylint: disable=protected-access
-            return os.path.join(os.path.abspath("."), relative_path)
-
         self.banner_photo = tk.PhotoImage(file=get_resource("assets/banner.png"))
         self.banner_image = ttk.Label(self.banner, image=self.banner_photo, border=0, background=banner_bg)
         self.banner_image.pack(side=tk.LEFT, padx=8, pady=8)
@@ -111,6 +193,7 @@ class PatcherApplication(tk.Tk):
         self.groupbox3 = ttk.LabelFrame(self, text="Options")
         self.groupbox3.pack(padx=8, pady=8, fill=tk.BOTH, expand=True)
         def _toggle_compress():
+            import patches # pylint: disable=import-outside-toplevel
             patches.COMPRESS_PACKAGE = self.compress_option.instate(["selected"])
         self.compress_state = tk.BooleanVar(value=False)
         self.compress_option = ttk.Checkbutton(self.groupbox3, text="Compress package (takes significantly longer)", variable=self.compress_state, command=_toggle_compress)
@@ -153,37 +236,76 @@ class PatcherApplication(tk.Tk):
         if self.tk.call("tk", "windowingsystem") == 'win32':
             self.iconbitmap(get_resource("assets/icon.ico"))
 
-        # Try the default paths
-        for path in DEFAULT_PATHS:
-            if os.path.exists(path):
-                self.input_dir.insert(0, path)
-                self.ea_games_dir = path
-                self.refresh_game_status()
-                break
-
         self.controls = [self.btn_browse, self.btn_patch, self.btn_revert, self.input_dir]
+
+        # Folders checked for write permission (path -> writable)
+        self.writable_dirs: Dict[str, bool] = {}
+
+        # Changes to the GUI from other threads
+        self.progress_queue: queue.Queue = queue.Queue()
+
+        # Set when the user cancels patching (shared with worker processes)
+        self.abort_patch = MP_CONTEXT.Event()
+
+        # Worker processes for patching, started when first needed
+        self.worker_pool: Optional[ProcessPoolExecutor] = None
+        self.worker_pool_settings: tuple = ()
+        self.worker_pool_size = 0
+        self.worker_progress: Optional[multiprocessing.queues.Queue] = None
+
+        # Threads that send changes to the progress queue, which is only drained while they run
+        self.background_threads: List[threading.Thread] = []
+        self.draining_queue = False
+
         self.update()
-        self._check_for_updates()
+        self.start_background_task(self._check_for_updates)
+
+        # Look for the game after the window has been drawn
+        self.after(100, self._try_default_paths)
+
+    def _try_default_paths(self):
+        """
+        Check the default paths for the EA Games folder, and if found, show its patch status.
+        """
+        path = find_default_games_dir()
+        if path:
+            self.input_dir.insert(0, path)
+            self.ea_games_dir = path
+            self.refresh_game_status()
 
     def _check_for_updates(self):
         """
         Check the GitHub repository for a newer version and quietly inform the user.
+        This runs in a separate thread. The result is cached to avoid checking on every launch.
         """
+        latest_version = read_version_cache()
+        if not latest_version:
+            import http.client # pylint: disable=import-outside-toplevel
+            import urllib.request # pylint: disable=import-outside-toplevel
+            try:
+                # Error responses raise HTTPError, which is an OSError.
+                # A dropped connection raises HTTPException, which isn't.
+                with urllib.request.urlopen(VERSION_URL, timeout=3) as r:
+                    latest_version = r.read().decode("utf-8").split("\n")[0]
+                write_version_cache(latest_version)
+            except (OSError, ValueError, http.client.HTTPException):
+                # Offline? Use the last known version, even if it's old
+                latest_version = read_version_cache(max_age=None)
+                if not latest_version:
+                    return
+
+        latest_ver_parts = latest_version.split(".")
         try:
-            r = requests.get("https://raw.githubusercontent.com/lah7/sims2-4k-ui-patch/master/version.txt", timeout=3)
-        except (requests.exceptions.RequestException, requests.exceptions.Timeout):
+            if int(latest_ver_parts[0]) > MAJOR or int(latest_ver_parts[1]) > MINOR:
+                self.progress_queue.put((self._show_update_available, (latest_version,)))
+        except (IndexError, TypeError, ValueError):
             return
 
-        if r.status_code == 200:
-            latest_version = r.text.split("\n")[0]
-            latest_ver_parts = latest_version.split(".")
-            try:
-                if int(latest_ver_parts[0]) > MAJOR or int(latest_ver_parts[1]) > MINOR:
-                    self.version.config(text=f"{VERSION} (New version available: v{latest_version})")
-                    self.set_enabled(self.version, True)
-                    self.update_available = True
-            except (TypeError, ValueError):
-                return
+    def _show_update_available(self, latest_version: str):
+        """Inform the user a newer version is available"""
+        self.version.config(text=f"{VERSION} (New version available: v{latest_version})")
+        self.set_enabled(self.version, True)
+        self.update_available = True
 
     def _open_homepage(self):
         if self.update_available:
@@ -195,11 +317,7 @@ class PatcherApplication(tk.Tk):
         """
         Open the file dialog to select the game's directory
         """
-        initial_dir = "C:\\" if os.name == "nt" else ""
-        for path in DEFAULT_PATHS:
-            if os.path.exists(path):
-                initial_dir = path
-                break
+        initial_dir = find_default_games_dir() or ("C:\\" if os.name == "nt" else "")
         dirname = filedialog.askdirectory(initialdir=initial_dir, title="Select EA GAMES directory", mustexist=True)
 
         if not dirname:
@@ -223,15 +341,24 @@ class PatcherApplication(tk.Tk):
     def set_status_bar_text(self, text: str):
         """Update the text on the status bar"""
         self.status_bar_text.configure(text=text)
-        self.update()
+        self.update_idletasks()
 
     def get_all_patchable_files(self) -> list:
         """
         Return a list of files that can be patched by this program.
         """
+        # Walk each game's folder once, looking for any of the files.
+        # File names are case insensitive on Windows, so compare them like the OS does.
+        filenames = {os.path.normcase(name): name for name in PATCHABLE_FILES}
+        skipped_dirs = frozenset(os.path.normcase(name) for name in SKIPPED_DIRS)
         files = []
-        for filename in ["ui.package", "FontStyle.ini", "CaSIEUI.data"]:
-            files += glob.glob(os.path.join(self.ea_games_dir, "*Sims 2*", "TSData") + f"/**/{filename}", recursive=True)
+        for tsdata_dir in glob.glob(os.path.join(self.ea_games_dir, "*Sims 2*", "TSData")):
+            for root, dirs, names in os.walk(tsdata_dir):
+                dirs[:] = [name for name in dirs if os.path.normcase(name) not in skipped_dirs]
+                for name in names:
+                    filename = filenames.get(os.path.normcase(name))
+                    if filename:
+                        files.append(os.path.join(root, filename))
         return sorted(files)
 
     def refresh_game_status(self):
@@ -256,30 +383,34 @@ class PatcherApplication(tk.Tk):
             self.set_status_bar_text("Missing EA Games Folder")
             return
 
-        # Gather list of game files
-        for path in patch_list:
-            file = GameFile(path)
-            self.game_files.append(file)
+        # Gather list of game files (reading their status from disk in parallel)
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            self.game_files = list(executor.map(GameFile, patch_list))
 
+        # Count the status of each game's files in a single pass
+        games_status = {}
+        for file in self.game_files:
             if not file.patched or file.patch_outdated:
                 self.set_enabled(self.btn_patch, True)
 
             if file.backed_up:
                 self.set_enabled(self.btn_revert, True)
 
-        # Generate an overall summary for each game
-        games_status = {}
-        for file in self.game_files:
             if file.game_name not in games_status:
-                games_status[file.game_name] = []
-            games_status[file.game_name].append(file)
+                games_status[file.game_name] = {"total": 0, "patched": 0, "backed_up": 0, "outdated": 0}
+            counts = games_status[file.game_name]
+            counts["total"] += 1
+            counts["patched"] += file.patched
+            counts["backed_up"] += file.backed_up
+            counts["outdated"] += file.patch_outdated
 
-        for game_name, files in games_status.items():
-            all_patched = all(file.patched for file in files)
-            all_backed_up = all(file.backed_up for file in files)
-            any_backups = any(file.backed_up for file in files)
-            any_outdated = any(file.patch_outdated for file in files)
-            partially_patched = not all_patched and any(file.patched for file in files)
+        # Generate an overall summary for each game
+        for game_name, counts in games_status.items():
+            all_patched = counts["patched"] == counts["total"]
+            all_backed_up = counts["backed_up"] == counts["total"]
+            any_backups = counts["backed_up"] > 0
+            any_outdated = counts["outdated"] > 0
+            partially_patched = 0 < counts["patched"] < counts["total"]
 
             status = "Unknown"
             if all_patched and all_backed_up:
@@ -313,84 +444,243 @@ class PatcherApplication(tk.Tk):
                 if not os.access(path, os.W_OK):
                     return False
 
-        # Is the folder writable?
-        testfile = os.path.join(os.path.dirname(file.file_path), "test.tmp")
+        # Is the folder writable? Many files share a folder, so only test each one once.
+        folder = os.path.dirname(file.file_path)
+        if folder not in self.writable_dirs:
+            self.writable_dirs[folder] = self.is_folder_writable(folder)
+
+        return self.writable_dirs[folder]
+
+    @staticmethod
+    def is_folder_writable(folder: str) -> bool:
+        """
+        Return a boolean to indicate a file can be created in this folder.
+        """
+        testfile = os.path.join(folder, "test.tmp")
         try:
             with open(testfile, "w", encoding="utf-8") as f:
                 f.write("\n")
             os.remove(testfile)
-        except PermissionError:
+            return True
+        except OSError:
+            # Such as a read only file system, or the folder was removed
             return False
 
-        return True
-
     def start_patch(self):
         """
         Perform the patching process!
         """
         try:
-            # 1. Check files/folders are writable
-            for file in self.game_files:
+            # 1. Check files/folders are writable, for the files that will be changed
+            files = self.get_files_to_patch()
+            self.writable_dirs.clear()
+
+            # Test the folders at the same time, as creating a file can be slow (e.g. antivirus scanning)
+            folders = list({os.path.dirname(file.file_path) for file in files})
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                self.writable_dirs.update(zip(folders, executor.map(self.is_folder_writable, folders)))
+
+            for file in files:
                 if not self.has_permission(file):
                     messagebox.showerror("Insufficient File Permissions", "In order to patch the game files, please run this program as an administrator, or change the folder permissions for the game directories.")
                     return
 
-            # Show detailed progress in a popup window
-            window = ProgressWindow(self)
-            for button in self.controls:
-                self.set_enabled(button, False)
-            self.set_status_bar_text("Patching...")
+        except Exception as e: # pylint: disable=broad-except
+            messagebox.showerror("Patch Failed", str(e))
+            return
 
-            # 2. Process each patchable game file
-            overall_current = 0
-            overall_total = len(self.game_files)
+        # Show detailed progress in a popup window
+        window = ProgressWindow(self)
+        self.abort_patch.clear()
+        for button in self.controls:
+            self.set_enabled(button, False)
+        self.set_status_bar_text("Patching...")
 
-            for file in self.game_files:
-                overall_current += 1
-                window.set_current_progress(f"Opening: {file.relative_path}", 0)
-                window.set_current_progress_max(1)
-                window.set_total_progress(file.game_name, overall_current / overall_total * 100)
-
-                if file.patched and not file.patch_outdated:
-                    # Skip files that are already up-to-date
-                    continue
-
-                if file.backed_up:
-                    # Always assume the original file is stored as the backup
-                    file.restore()
-                elif file.patched and not file.backed_up:
-                    # Can't do anything with this file!
-                    continue
-
-                # Always create a copy of the original before processing
-                file.backup()
-
-                if file.name == "FontStyle.ini":
-                    window.set_current_progress("Upscaling FontStyle.ini...", 0)
-                    patches.upscale_fontstyle_ini(file)
-
-                elif file.name in ["ui.package", "CaSIEUI.data"]:
-                    package = dbpf.DBPF(file.backup_path)
-                    window.set_current_progress_max(len(package.get_entries()))
-                    patches.upscale_package_contents(file, package, window.set_current_progress)
-
-            window.in_progress = False
-            window.destroy()
-            self.set_status_bar_text("Done!")
-            messagebox.showinfo("Success!", "Patching completed successfully!")
-            window.stop_patch()
+        # 2. Process each patchable game file (in the background)
+        self.start_background_task(self._patch_files, window, files)
+
+    def get_files_to_patch(self) -> List[GameFile]:
+        """
+        Return the game files that need patching. Files that are already up-to-date
+        are skipped, as are patched files that can't be re-patched without a backup.
+        """
+        return [file for file in self.game_files if not file.patched or (file.patch_outdated and file.backed_up)]
+
+    def _patch_files(self, window: "ProgressWindow", files: List[GameFile]):
+        """
+        Process each patchable game file. This runs in a separate thread to keep
+        the interface responsive, so changes to the GUI are sent to the progress queue.
+        """
+        def _ui(func: Callable, *args):
+            self.progress_queue.put((func, args))
+
+        last_progress_update = (0.0, 0) # Time and total
+
+        def _update_current_progress(text: str, value: int|float, total: Optional[int] = None):
+            # Redrawing more than ~30 times a second only slows things down
+            nonlocal last_progress_update
+            now = time.monotonic()
+            last_time, last_total = last_progress_update
+            if total in (None, last_total) and now - last_time < 0.033:
+                return
+            last_progress_update = (now, total or last_total)
+            _ui(window.set_current_progress, text, value, total)
+
+        import patches # pylint: disable=import-outside-toplevel
+
+        try:
+            completed = 0
+            total = len(files)
+            _update_current_progress(f"Patching {total} files...", 0, max(total, 1))
+
+            # Each file is patched in its own process, using all CPU cores
+            executor = self._get_worker_pool(total)
+            worker_progress = self.worker_progress
+            assert worker_progress
+
+            # Start the biggest files first, so a large package isn't left running on its own at the end
+            files = sorted(files, key=lambda file: os.path.getsize(file.backup_path if file.backed_up else file.file_path), reverse=True)
+            jobs = {executor.submit(patches.patch_game_file, file): file for file in files}
+            pending = set(jobs)
+
+            # Several files are patched at once, but only one file's progress is shown at a time.
+            # The total is only sent when it changes, so remember it for each file.
+            shown_path = None
+            file_totals: Dict[str, int] = {}
+            try:
+                while pending and not self.abort_patch.is_set():
+                    done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+
+                    # Pass on progress sent by the workers for the file being shown
+                    while True:
+                        try:
+                            path, text, value, current_total = worker_progress.get_nowait()
+                        except queue.Empty:
+                            break
+                        if current_total:
+                            file_totals[path] = current_total
+                        if shown_path is None:
+                            shown_path = path
+                            current_total = file_totals.get(path)
+                        if path == shown_path:
+                            _update_current_progress(text, value, current_total)
+
+                    for job in done:
+                        job.result()
+                        file = jobs[job]
+                        completed += 1
+                        file_totals.pop(file.file_path, None)
+                        if file.file_path == shown_path:
+                            # Show the next file that sends progress
+                            shown_path = None
+                        _ui(window.set_total_progress, file.game_name, completed / total * 100)
+            except Exception:
+                # Stop the other files too, then report the error
+                self.abort_patch.set()
+                raise
+            finally:
+                # Don't start any more files when cancelled or a file failed,
+                # and let the files in progress stop before the workers are used again.
+                for job in jobs:
+                    job.cancel()
+                wait(jobs)
+
+            if self.abort_patch.is_set():
+                _ui(self._patch_stopped, window, "Patching cancelled")
+            else:
+                _ui(self._patch_finished, window)
 
         except PermissionError:
-            messagebox.showerror("Permission Error", "The file might be in use by another program. Please close any processes using the file and try patching again.")
-            window.in_progress = False
-            window.destroy()
-            window.stop_patch()
+            _ui(self._patch_failed, window, "Permission Error", "The file might be in use by another program. Please close any processes using the file and try patching again.")
 
         except Exception as e: # pylint: disable=broad-except
-            messagebox.showerror("Patch Failed", str(e))
-            window.in_progress = False
-            window.destroy()
-            window.stop_patch()
+            # Start again with new processes, in case the pool broke
+            self.shutdown_worker_pool()
+            _ui(self._patch_failed, window, "Patch Failed", str(e))
+
+    def _get_worker_pool(self, file_count: int) -> ProcessPoolExecutor:
+        """
+        Return the pool of processes that patch the game files. The pool is kept for the next
+        patch, so the processes don't need to start again, unless the patch settings changed
+        or more files need patching than the pool has processes for.
+        """
+        import patches # pylint: disable=import-outside-toplevel
+        settings = (patches.UI_MULTIPLIER, patches.UPSCALE_FILTER, patches.COMPRESS_PACKAGE, gamefile.FILE_PATCH_VERSION)
+        workers = max(1, min(get_cpu_count(), MAX_WORKERS, file_count))
+        if self.worker_pool and self.worker_pool_settings == settings and self.worker_pool_size >= workers:
+            return self.worker_pool
+
+        self.shutdown_worker_pool()
+        self.worker_progress = MP_CONTEXT.Queue()
+        self.worker_pool = ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT,
+                                               initializer=patches.init_worker, initargs=settings + (self.abort_patch, self.worker_progress))
+        self.worker_pool_settings = settings
+        self.worker_pool_size = workers
+        return self.worker_pool
+
+    def shutdown_worker_pool(self):
+        """Stop the processes used for patching, if they were started"""
+        if self.worker_pool:
+            self.worker_pool.shutdown(cancel_futures=True)
+            self.worker_pool = None
+        if self.worker_progress:
+            self.worker_progress.close()
+            self.worker_progress = None
+
+    def _patch_finished(self, window: "ProgressWindow"):
+        """Patching completed successfully"""
+        self._patch_stopped(window, "Done!")
+        messagebox.showinfo("Success!", "Patching completed successfully!")
+
+    def _patch_failed(self, window: "ProgressWindow", title: str, message: str):
+        """Patching stopped due to an error"""
+        messagebox.showerror(title, message)
+        self._patch_stopped(window, "Patch failed")
+
+    def _patch_stopped(self, window: "ProgressWindow", status: str):
+        """Close the progress window and show the current state of the game files"""
+        window.in_progress = False
+        window.destroy()
+        self.set_enabled(self.btn_browse, True)
+        self.set_enabled(self.input_dir, True)
+        self.refresh_game_status()
+        self.set_status_bar_text(status)
+
+    def start_background_task(self, target: Callable, *args):
+        """
+        Run a function in a separate thread. Changes to the GUI it sends to the
+        progress queue are applied until the thread finishes.
+        """
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.background_threads.append(thread)
+        if not self.draining_queue:
+            self.draining_queue = True
+            self.after(33, self._drain_progress_queue)
+
+    def _drain_progress_queue(self):
+        """
+        Apply changes to the GUI requested by background threads.
+        TK is not thread safe, so this runs periodically on the main thread,
+        but only while there's a thread that could send changes.
+        """
+        while True:
+            try:
+                func, args = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception: # pylint: disable=broad-except
+                # Report it like Tk does for its own callbacks, and keep applying the other changes
+                self.report_callback_exception(*sys.exc_info())
+
+        # Check the queue again, in case a thread sent its last change before finishing
+        self.background_threads = [thread for thread in self.background_threads if thread.is_alive()]
+        if self.background_threads or not self.progress_queue.empty():
+            self.after(33, self._drain_progress_queue)
+        else:
+            self.draining_queue = False
 
     def start_revert(self):
         """Undo the patches by restoring the backup files."""
@@ -398,15 +688,35 @@ class PatcherApplication(tk.Tk):
         if not confirmation:
             return
 
+        for button in self.controls:
+            self.set_enabled(button, False)
         self.set_status_bar_text("Restoring backup files...")
+        self.start_background_task(self._revert_files)
+
+    def _revert_files(self):
+        """
+        Restore each backup file. This runs in a separate thread, as copying
+        the files can take a while, so the result is sent to the progress queue.
+        """
         try:
             for file in self.game_files:
                 file.restore()
         except PermissionError:
-            messagebox.showerror("Insufficient File Permissions", "In order to revert the game files, please run this program as an administrator, or change the folder permissions for the game directories.")
+            self.progress_queue.put((self._revert_finished, ("Insufficient File Permissions", "In order to revert the game files, please run this program as an administrator, or change the folder permissions for the game directories.")))
+            return
         except Exception as e: # pylint: disable=broad-except
-            messagebox.showerror("Revert Failed", str(e))
+            self.progress_queue.put((self._revert_finished, ("Revert Failed", str(e))))
+            return
+
+        self.progress_queue.put((self._revert_finished, ()))
+
+    def _revert_finished(self, title: str = "", message: str = ""):
+        """Restoring backups completed, or stopped due to an error"""
+        if title:
+            messagebox.showerror(title, message)
 
+        self.set_enabled(self.btn_browse, True)
+        self.set_enabled(self.input_dir, True)
         self.refresh_game_status()
 
 
@@ -416,7 +726,7 @@ class ProgressWindow(tk.Toplevel):
     """
     def __init__(self, parent):
         super().__init__(parent)
-        self.parent: tk.Tk = parent
+        self.parent: PatcherApplication = parent
         self.in_progress = True
 
         self.title("Patching in Progress")
@@ -458,47 +768,44 @@ class ProgressWindow(tk.Toplevel):
 
         self.protocol("WM_DELETE_WINDOW", self.stop_patch)
 
-    def _reload_app(self):
-        self.destroy()
-        self.parent.destroy()
-        os.execl(sys.executable, sys.executable, *sys.argv)
-
     def stop_patch(self):
         """
-        Abort or patching finished. Restart the application.
-        If patching was aborted while in progress, confirm with the user.
+        Abort patching, after confirming with the user.
 
-        The UI may be briefly unresponsive because we're not technically running in a separate thread.
-        Files are safe, even if interrupting the middle of a file patch, as they are not overwritten until
-        the processing of that file is completed.
+        Patching runs in a separate thread, so this can be clicked at any time.
+        The thread stops before the next file or package entry. Files are safe, even if interrupting
+        the middle of a file patch, as they are not overwritten until the processing of that file is completed.
         """
         if not self.in_progress:
-            return self._reload_app()
+            return
 
-        confirmed = messagebox.askyesno("Cancel Patching", "Abort patching?\n\nThe game will be left partially patched. You can resume later, or click \"Revert\" on the next screen to restore the original files.")
-        if confirmed:
-            return self._reload_app()
+        confirmed = messagebox.askyesno("Cancel Patching", "Abort patching?\n\nThe game will be left partially patched. You can resume later, or click \"Revert\" to restore the original files.")
+        if confirmed and self.in_progress:
+            self.cancel_btn.configure(text="Cancelling...", state=tk.DISABLED)
+            self.parent.abort_patch.set()
 
     def set_current_progress(self, text: str, value: int|float, total: Optional[int] = None):
         """Update the progress bar and text for the currently processed item"""
         self.current_progress_text.configure(text=text)
         self.current_progress_bar.configure(value=value)
         if total:
-            return self.set_current_progress_max(total)
-        self.update()
+            self.set_current_progress_max(total)
 
     def set_current_progress_max(self, value: int):
         """Update the maximum value of the progress bar for the currently processed item"""
         self.current_progress_bar.configure(maximum=value)
-        self.update()
 
     def set_total_progress(self, text: str, value: int|float):
         """Update the progress bar and text for the overall progress"""
         self.total_progress_text.configure(text=text)
         self.total_progress_bar.configure(value=value)
-        self.update()
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     app = PatcherApplication()
     app.mainloop()
+
+    # Stop any patch still running when the window was closed
+    app.abort_patch.set()
+    app.shutdown_worker_pool()
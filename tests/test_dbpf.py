@@ -4,8 +4,10 @@ works as expected to read and write valid ui.package files.
 """
 import hashlib
 import os
+import pickle
 import tempfile
 import unittest
+from unittest import mock
 
 import dbpf
 
@@ -327,3 +329,81 @@ class DBPFTest(unittest.TestCase):
             pkg.get_entry(0, 0x10, 0x30, 0x40).data == b"ThreeThreeThreeThree",
         ]
         self.assertTrue(all(results))
+
+
+class DBPFFileTest(unittest.TestCase):
+    """
+    Test reading and writing packages using only the small files included in the test directory.
+    """
+    def _mktemp(self) -> str:
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_pickle_package_from_path(self):
+        """Check a package read from a path can be pickled, such as to send to another process"""
+        pkg = dbpf.DBPF("tests/files/index_7.2_compressed.package")
+        pkg2 = pickle.loads(pickle.dumps(pkg))
+        self.assertEqual(pkg2.get_entry(0, 0x10, 0x20, 0x30).data, b"OneOneOneOne")
+        self.assertEqual(pkg.read_at_position(0, 4), 0)
+
+    def test_empty_file(self):
+        """Check an empty file is read as an empty package"""
+        pkg = dbpf.DBPF(self._mktemp())
+        self.assertEqual(len(pkg.get_entries()), 0)
+
+    def test_corrupt_compressed_entry(self):
+        """Check a corrupt compressed file raises ValueError when its data is used"""
+        entry = dbpf.Entry()
+        entry.set_compressed_data(bytes(9) + b"\x00\x00", 2) # Copies past the end of the file
+        with self.assertRaisesRegex(ValueError, "Decompression failed"):
+            _ = entry.data
+
+    def test_compress_verify_failed(self):
+        """Check data is left uncompressed when it doesn't decompress back"""
+        pkg = dbpf.DBPF()
+        with mock.patch("qfs.decompress", side_effect=ValueError("Error: array too small")):
+            self.assertEqual(pkg._compress_data(b"OneOneOneOne" * 10, 0, 1), bytes()) # pylint: disable=protected-access
+
+    def test_file_size_ends_with_index(self):
+        """Check the package ends with the index, even when the last index field is zero"""
+        pkg = dbpf.DBPF()
+        pkg.add_entry(dbpf.TYPE_IMAGE, 0x01, 0x02, 0, b"Hello World!")
+        pkg.add_entry(dbpf.TYPE_IMAGE, 0x01, 0x03, 0, b"") # File size of 0 is the last field
+        pkg_path = self._mktemp()
+        pkg.save_package(pkg_path)
+
+        pkg = dbpf.DBPF(pkg_path)
+        self.assertEqual(os.path.getsize(pkg_path), pkg.header.index_start_offset + pkg.header.index_size)
+        self.assertEqual(pkg.get_entries()[-1].data, b"")
+
+    def test_read_index_72_with_dir(self):
+        """Check a 7.2 index with a DIR record reads exactly the number of entries in the header"""
+        pkg = dbpf.DBPF("tests/files/index_7.2_compressed.package")
+        entries = pkg.get_entries()
+        self.assertEqual(len(entries), pkg.header.index_entry_count)
+        self.assertEqual(len(entries), 4)
+        self.assertEqual([entry.type_id for entry in entries].count(dbpf.TYPE_DIR), 1)
+
+    def test_decompress_on_first_use(self):
+        """Check compressed files are decompressed when their data is first used"""
+        # pylint: disable=protected-access
+        pkg = dbpf.DBPF("tests/files/index_7.2_compressed.package")
+        entry = pkg.get_entry(0, 0x10, 0x30, 0x40)
+        self.assertTrue(entry.compress)
+        self.assertIsNotNone(entry._compressed_data)
+
+        data = entry.data
+        self.assertIsNone(entry._compressed_data)
+        self.assertEqual(len(data), entry._decompressed_size)
+        self.assertIs(entry.data, data)
+
+    def test_set_data_of_compressed_file(self):
+        """Check replacing the data of a compressed file discards the compressed bytes"""
+        # pylint: disable=protected-access
+        pkg = dbpf.DBPF("tests/files/index_7.2_compressed.package")
+        entry = pkg.get_entry(0, 0x10, 0x30, 0x40)
+        entry.data = b"Replaced"
+        self.assertIsNone(entry._compressed_data)
+        self.assertEqual(entry.data, b"Replaced")
@@ -53,3 +53,10 @@ class QFSTest(unittest.TestCase):
         got = int.from_bytes(output[6:9], byteorder="big")
         expected = len(bytes(original))
         self.assertTrue(got == expected)
+
+    def test_decompress_repeating(self):
+        """Test overlapping offset copies (repeating patterns) decompress correctly"""
+        original = b"AB" * 500 + b"C" * 700 + b"ABCDEFGH" * 40
+        output = qfs.compress(bytearray(original))
+        self.assertTrue(len(output) < len(original))
+        self.assertTrue(qfs.decompress(output, len(original)) == original)